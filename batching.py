@@ -0,0 +1,26 @@
+# Shared batching for the asyncio queue workers (request logs, usage rows, moderation calls)
+import asyncio
+from typing import Any
+
+# Default stop marker: never queued, so batches only end on size or time
+_NO_STOP = object()
+
+def take_batch(q: asyncio.Queue, batch: list, max_size: int, stop: Any = _NO_STOP) -> list:
+    """Move queued items into batch without waiting, up to max_size or a stop marker."""
+    while len(batch) < max_size and (not batch or batch[-1] is not stop):
+        try:
+            batch.append(q.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+    return batch
+
+async def next_batch(q: asyncio.Queue, max_size: int, wait_s: float, stop: Any = _NO_STOP) -> list:
+    """Wait for one item, then give the batch up to wait_s to fill to max_size.
+
+    A queued stop marker ends the batch early and is returned as its last item.
+    """
+    batch = [await q.get()]
+    if len(take_batch(q, batch, max_size, stop)) < max_size and batch[-1] is not stop:
+        await asyncio.sleep(wait_s)
+        take_batch(q, batch, max_size, stop)
+    return batch
@@ -1,28 +1,55 @@
 import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Tuple
 from dotenv import load_dotenv
 
-load_dotenv()
-
-# Core
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "changeme-admin-token")
-
-# Database (SQLite dev by default; set to Postgres/Supabase in prod)
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./palisade.db")
-
-# API key signup/admin gating for /keys + /admin endpoints
-SIGNUP_SECRET = os.getenv("SIGNUP_SECRET")  # if unset, /keys is open (dev mode)
-
-# API key generation
-KEY_PREFIX = os.getenv("KEY_PREFIX", "pal_live_")
-KEY_BYTES = int(os.getenv("KEY_BYTES", "24"))  # raw token bytes before urlsafe encoding
-
-# Legacy env-based keys (fallback if DB empty or for quick tests)
-PALISADE_API_KEYS = [k.strip() for k in os.getenv("PALISADE_API_KEYS", os.getenv("PALISADE_API_KEY", "")).split(",") if k.strip()]
-
-# Rate limit (requests/min per key)
-RATE_LIMIT_RPM = int(os.getenv("RATE_LIMIT_RPM", "60"))
-
-# Logging
-LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+@dataclass(frozen=True, slots=True)
+class Settings:
+    openai_api_key: Optional[str]
+    admin_token: str
+    database_url: str
+    signup_secret: Optional[str]
+    key_prefix: str
+    key_bytes: int
+    palisade_api_keys: Tuple[str, ...]
+    rate_limit_rpm: int
+    log_level: str
+
+@lru_cache(maxsize=1)
+def settings() -> Settings:
+    """Read the environment once per process; later calls return the same snapshot."""
+    if not os.getenv("PALISADE_SKIP_DOTENV"):
+        load_dotenv()
+    env = os.environ
+    legacy_keys = env.get("PALISADE_API_KEYS", env.get("PALISADE_API_KEY", ""))
+    return Settings(
+        # Core
+        openai_api_key=env.get("OPENAI_API_KEY"),
+        admin_token=env.get("ADMIN_TOKEN", "changeme-admin-token"),
+        # Database (SQLite dev by default; set to Postgres/Supabase in prod)
+        database_url=env.get("DATABASE_URL", "sqlite:///./palisade.db"),
+        # API key signup/admin gating for /keys + /admin endpoints
+        signup_secret=env.get("SIGNUP_SECRET"),  # if unset, /keys is open (dev mode)
+        # API key generation
+        key_prefix=env.get("KEY_PREFIX", "pal_live_"),
+        key_bytes=int(env.get("KEY_BYTES", "24")),  # raw token bytes before urlsafe encoding
+        # Legacy env-based keys (fallback if DB empty or for quick tests)
+        palisade_api_keys=tuple(k.strip() for k in legacy_keys.split(",") if k.strip()),
+        # Rate limit (requests/min per key)
+        rate_limit_rpm=int(env.get("RATE_LIMIT_RPM", "60")),
+        # Logging
+        log_level=env.get("LOG_LEVEL", "INFO"),
+    )
+
+# Module-level aliases for existing imports
+_settings = settings()
+OPENAI_API_KEY = _settings.openai_api_key
+ADMIN_TOKEN = _settings.admin_token
+DATABASE_URL = _settings.database_url
+SIGNUP_SECRET = _settings.signup_secret
+KEY_PREFIX = _settings.key_prefix
+KEY_BYTES = _settings.key_bytes
+PALISADE_API_KEYS = _settings.palisade_api_keys
+RATE_LIMIT_RPM = _settings.rate_limit_rpm
+LOG_LEVEL = _settings.log_level
@@ -1,16 +1,59 @@
 from sqlalchemy import (
     create_engine, Column, Integer, String, Boolean, DateTime,
-    func, Index, JSON, Text, ForeignKey
+    func, Index, JSON, Text, ForeignKey, event, inspect, text
 )
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.exc import OperationalError
 from config import DATABASE_URL
+import asyncio
+import orjson
 
 # Engine
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, connect_args=connect_args)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+connect_args = {"check_same_thread": False} if IS_SQLITE else {}
+# Stale connections are retired by age instead of a SELECT 1 pre-ping on every checkout.
+# Pool sizing applies to server databases; SQLite keeps SQLAlchemy's default pool.
+pool_args = {"pool_recycle": 1800}
+if not IS_SQLITE:
+    pool_args.update(pool_size=20, max_overflow=40)
+
+# JSON columns (Postgres) serialize through orjson instead of stdlib json
+def _json_dumps(obj) -> str:
+    return orjson.dumps(obj).decode()
+
+# query_cache_size: keep the compiled-statement cache large enough that hot queries are never evicted
+engine = create_engine(DATABASE_URL, query_cache_size=1200, json_serializer=_json_dumps, connect_args=connect_args, **pool_args)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+# Async engine for handlers running on the event loop (aiosqlite / asyncpg)
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+def _async_url(url: str):
+    u = make_url(url)
+    return u.set(drivername=_ASYNC_DRIVERS.get(u.get_backend_name(), u.drivername))
+
+async_engine = create_async_engine(_async_url(DATABASE_URL), query_cache_size=1200, json_serializer=_json_dumps, connect_args=connect_args, **pool_args)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+# SQLite: WAL lets readers (admin views) proceed while the log writer commits
+def _sqlite_pragmas(dbapi_conn, _record):
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+if IS_SQLITE:
+    event.listen(engine, "connect", _sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+
+# FastAPI dependency: one session per request, always returned to the pool
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 Base = declarative_base()
 
 class ApiKey(Base):
@@ -21,6 +64,8 @@ class ApiKey(Base):
     name = Column(String(128), nullable=True)  
     key_salt = Column(String(128), nullable=False)
     key_hash = Column(String(128), nullable=False, index=True)
+    # Non-secret lookup id (short blake2b of the plaintext) so auth fetches one row, not all
+    key_lookup = Column(String(16), nullable=True, index=True)
     prefix = Column(String(32), nullable=False, default="pal_live_")
     is_active = Column(Boolean, nullable=False, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -38,11 +83,39 @@ class RequestLog(Base):
     status_code = Column(Integer)
     duration_ms = Column(Integer)
     # Moderation result: PG uses JSON, SQLite falls back to text
-    moderation_result = Column(JSON if not DATABASE_URL.startswith("sqlite") else Text)
+    moderation_result = Column(JSON if not IS_SQLITE else Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+# Serves ORDER BY created_at DESC LIMIT N (admin log views) as an index range scan
+Index("ix_palisade_request_logs_created_desc", RequestLog.created_at.desc(), RequestLog.api_key_id)
+# admin_logs filters by key or endpoint and pages on id DESC: index-ordered scans, no sort
+Index("ix_palisade_request_logs_key_id_desc", RequestLog.api_key_id, RequestLog.id.desc())
+Index("ix_palisade_request_logs_endpoint_id_desc", RequestLog.endpoint, RequestLog.id.desc())
+
+def _add_missing_columns():
+    """create_all never alters existing tables; add nullable columns introduced later."""
+    insp = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing or not col.nullable:
+                continue
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(engine.dialect)}"))
+
 def init_db():
     try:
         Base.metadata.create_all(bind=engine)
+        _add_missing_columns()
+        # create_all skips indexes on tables that already exist
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
     except OperationalError as e:
         raise
+
+async def init_db_async():
+    """init_db for the app lifespan; the DDL/inspection runs off the event loop."""
+    await asyncio.to_thread(init_db)
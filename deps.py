@@ -0,0 +1,64 @@
+# Shared FastAPI dependencies: signup-secret gate and API-key record lookup
+from fastapi import Depends, HTTPException, Header
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+import hmac
+from config import SIGNUP_SECRET
+from db import get_async_db, ApiKey
+from key_utils import (
+    match_key, needs_rehash, hash_key, key_lookup,
+    key_digest, get_cached_key, cache_key, is_known_bad_key, cache_bad_key, invalidate_key,
+)
+
+def require_signup_secret(x_signup_secret: Optional[str] = Header(default=None, convert_underscores=False)):
+    # In prod, require header to match SIGNUP_SECRET; in dev (unset), allow.
+    if SIGNUP_SECRET:
+        # Constant-time compare so response timing doesn't leak the secret
+        if not x_signup_secret or not hmac.compare_digest(x_signup_secret.encode(), SIGNUP_SECRET.encode()):
+            raise HTTPException(status_code=401, detail="Missing or invalid signup secret")
+
+async def resolve_key(db: AsyncSession, plaintext: str) -> Optional[ApiKey]:
+    """Return the active key matching plaintext, or None.
+
+    Skips known-bad keys, seeks on key_lookup (falling back to rows that predate it),
+    verifies with match_key, rehashes/backfills on match, and caches the outcome.
+    The positive-cache fast path stays with the callers: the moderation path only
+    needs the key id, /keys/me the full record.
+    """
+    digest = key_digest(plaintext)
+    if is_known_bad_key(digest):
+        return None
+    # Index seek on key_lookup, then one constant-time hash compare
+    lookup = key_lookup(plaintext)
+    active = select(ApiKey).where(ApiKey.is_active == True)
+    rows = (await db.execute(active.where(ApiKey.key_lookup == lookup))).scalars().all()
+    if not rows:
+        # Keys created before key_lookup existed; backfilled on first match
+        rows = (await db.execute(active.where(ApiKey.key_lookup.is_(None)))).scalars().all()
+    rec = match_key(rows, plaintext)
+    if rec is None:
+        # Fail closed: no candidate matched
+        cache_bad_key(digest)
+        return None
+    if needs_rehash(rec.key_hash) or rec.key_lookup is None:
+        rec.key_hash = hash_key(rec.key_salt, plaintext)
+        rec.key_lookup = lookup
+        await db.commit()
+    cache_key(digest, rec.id, rec.is_active)
+    return rec
+
+async def get_api_key_record(x_api_key: Optional[str] = Header(default=None, convert_underscores=False), db: AsyncSession = Depends(get_async_db)) -> ApiKey:
+    if not x_api_key:
+        raise HTTPException(status_code=401, detail="Missing API key")
+    # Recently seen keys skip the hash compare (same cache as the moderation auth path)
+    cached = get_cached_key(key_digest(x_api_key))
+    if cached and cached[1]:
+        rec = await db.get(ApiKey, cached[0])
+        if rec is not None and rec.is_active:
+            return rec
+        invalidate_key(cached[0])
+    rec = await resolve_key(db, x_api_key)
+    if rec is None:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    return rec
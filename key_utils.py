@@ -1,12 +1,92 @@
-import secrets, hashlib
+import secrets, hashlib, hmac, threading
+from typing import Iterable, Optional, Tuple
+from cachetools import TTLCache
+
+# Tag for keyed-BLAKE2b hashes; untagged hashes are legacy sha256(salt + key)
+# and get upgraded the next time the key authenticates.
+HASH_PREFIX = "b2$"
 
 def generate_key(prefix: str, nbytes: int):
-    """Return (plaintext_key, salt, hash). Hash = sha256(salt + key)."""
+    """Return (plaintext_key, salt, hash). Hash = blake2b(key, key=salt)."""
     raw = secrets.token_urlsafe(nbytes)
     plaintext = f"{prefix}{raw}"
     salt = secrets.token_hex(16)
-    h = hashlib.sha256((salt + plaintext).encode()).hexdigest()
-    return plaintext, salt, h
+    return plaintext, salt, hash_key(salt, plaintext)
 
 def hash_key(salt: str, plaintext: str) -> str:
-    return hashlib.sha256((salt + plaintext).encode()).hexdigest()
\ No newline at end of file
+    # Salt is the blake2b key, so no salt + plaintext concatenation per call
+    h = hashlib.blake2b(plaintext.encode(), key=bytes.fromhex(salt), digest_size=32).hexdigest()
+    return HASH_PREFIX + h
+
+def key_lookup(plaintext: str) -> str:
+    """Short, non-secret identifier stored alongside the hash and used to find the row."""
+    return hashlib.blake2b(plaintext.encode(), digest_size=8).hexdigest()
+
+def _legacy_hash_key(salt: str, plaintext: str) -> str:
+    return hashlib.sha256((salt + plaintext).encode()).hexdigest()
+
+def needs_rehash(stored_hash: str) -> bool:
+    return not (stored_hash or "").startswith(HASH_PREFIX)
+
+def verify_key(stored_hash: str, salt: str, plaintext: str) -> bool:
+    """Constant-time check of plaintext against the stored hash.
+
+    hash_key is a fixed-cost keyed blake2b (no data-dependent branches), and the
+    digests are compared with hmac.compare_digest, never ==.
+    """
+    stored_hash = stored_hash or ""
+    if needs_rehash(stored_hash):
+        expected = _legacy_hash_key(salt, plaintext)
+    else:
+        expected = hash_key(salt, plaintext)
+    return hmac.compare_digest(stored_hash, expected)
+
+def match_key(rows: Iterable, plaintext: str):
+    """Return the row whose (key_hash, key_salt) matches plaintext, or None.
+
+    Every candidate is verified, even after a match, so the time taken doesn't
+    reveal which row matched. Callers fetch candidates by key_lookup, so this is
+    normally one compare.
+    """
+    match = None
+    for rec in rows:
+        ok = verify_key(rec.key_hash, rec.key_salt, plaintext)
+        if ok and match is None:
+            match = rec
+    return match
+
+# ==== Auth cache: digest(plaintext) -> (api_key_id, is_active) ====
+# Skips the DB lookup for keys seen recently. TTLCache isn't thread-safe and sync
+# dependencies run in the threadpool, so every access goes through the lock.
+KEY_CACHE_TTL_S = 60
+# Negative entries (no matching active key) expire sooner so new keys aren't masked for long
+BAD_KEY_CACHE_TTL_S = 10
+_key_cache: TTLCache = TTLCache(maxsize=10_000, ttl=KEY_CACHE_TTL_S)
+_bad_key_cache: TTLCache = TTLCache(maxsize=10_000, ttl=BAD_KEY_CACHE_TTL_S)
+_key_cache_lock = threading.Lock()
+
+def key_digest(plaintext: str) -> bytes:
+    return hashlib.blake2b(plaintext.encode(), digest_size=32).digest()
+
+def get_cached_key(digest: bytes) -> Optional[Tuple[int, bool]]:
+    with _key_cache_lock:
+        return _key_cache.get(digest)
+
+def cache_key(digest: bytes, api_key_id: int, is_active: bool = True) -> None:
+    with _key_cache_lock:
+        _key_cache[digest] = (api_key_id, is_active)
+
+def is_known_bad_key(digest: bytes) -> bool:
+    with _key_cache_lock:
+        return digest in _bad_key_cache
+
+def cache_bad_key(digest: bytes) -> None:
+    with _key_cache_lock:
+        _bad_key_cache[digest] = True
+
+def invalidate_key(api_key_id: int) -> None:
+    """Drop every cached entry for a key id (call on revoke)."""
+    with _key_cache_lock:
+        for digest, (kid, _) in list(_key_cache.items()):
+            if kid == api_key_id:
+                del _key_cache[digest]
@@ -2,42 +2,132 @@ from fastapi import FastAPI, Request, Depends, HTTPException
 from fastapi.responses import HTMLResponse, JSONResponse, FileResponse  # ⬅️ added FileResponse
 from fastapi.staticfiles import StaticFiles                            # ⬅️ added StaticFiles
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.concurrency import iterate_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.routing import APIRoute
+from sqlalchemy import select, bindparam
 from routes_admin import router as admin_router
-import logging, json, uuid, time, pathlib
+from typing import Any, Dict, List, Optional
+import asyncio, hmac, logging, logging.handlers, queue, sys, uuid, time, pathlib
+import orjson
+from contextlib import asynccontextmanager
+from pydantic import BaseModel
 
-from config import LOG_LEVEL, ADMIN_TOKEN
-from db import init_db, SessionLocal, RequestLog, ApiKey
-from routes import router
+from batching import next_batch, take_batch
+from config import LOG_LEVEL, settings
+from sqlalchemy.ext.asyncio import AsyncSession
+from db import init_db_async, get_async_db, engine, async_engine, RequestLog, ApiKey
+from routes import (
+    router, client as openai_client,
+    start_moderation_batcher, stop_moderation_batcher, start_usage_flusher, stop_usage_flusher,
+)
 from routes_keys import router as keys_router
 
 # Configure logging
 logging.basicConfig(level=getattr(logging, LOG_LEVEL.upper(), logging.INFO))
 logger = logging.getLogger("palisade")
 
-app = FastAPI(
-    title="Palisade Moderation API",
-    description="Real-time, contextual moderation for text and image content. Built for speed, accuracy, and developer ease.",
-    version="1.2.0",
-)
+# ===== Async batched log writer =====
+# Middleware enqueues records; one background task drains them in batches so the
+# request path never blocks on JSON encoding or log I/O.
+LOG_QUEUE_MAX = 10000
+LOG_BATCH_SIZE = 200
+LOG_BATCH_WAIT_S = 0.05
 
-# CORS (keep permissive for now; tighten later)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+_log_queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=LOG_QUEUE_MAX)
+_log_task: Optional[asyncio.Task] = None
+# Queued last by _stop_log_writer; everything ahead of it is written first
+_LOG_STOP = object()
+
+def _enqueue_log(record: Dict[str, Any]) -> None:
+    """Fire-and-forget; drops the record if the queue is full."""
+    try:
+        _log_queue.put_nowait(record)
+    except asyncio.QueueFull:
+        pass
+
+def _log_default(value):
+    # Body previews are queued as raw bytes; decode here, off the request path
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).decode("utf-8", errors="ignore")
+    raise TypeError
+
+def _write_logs(batch: list) -> None:
+    if not batch:
+        return
+    try:
+        # One orjson pass per record, newline-terminated, joined into a single write
+        lines = b"".join(orjson.dumps(r, default=_log_default, option=orjson.OPT_APPEND_NEWLINE) for r in batch)
+        logger.info(lines[:-1].decode())
+    except Exception:
+        logger.exception("Failed to write request logs")
+
+async def _drain_logs():
+    while True:
+        # Give each batch up to LOG_BATCH_WAIT_S to fill before flushing
+        batch = await next_batch(_log_queue, LOG_BATCH_SIZE, LOG_BATCH_WAIT_S, _LOG_STOP)
+        stopping = batch[-1] is _LOG_STOP
+        if stopping:
+            batch.pop()
+        _write_logs(batch)
+        if stopping:
+            return
+
+async def _stop_log_writer(timeout: float = 5.0) -> None:
+    """Write pending records and stop the writer task."""
+    global _log_task
+    task, _log_task = _log_task, None
+    if task is not None:
+        await _log_queue.put(_LOG_STOP)
+        try:
+            await asyncio.wait_for(task, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+    # Records enqueued behind the stop marker
+    while not _log_queue.empty():
+        _write_logs(take_batch(_log_queue, [], LOG_BATCH_SIZE))
+
+# ===== Usage breadcrumbs =====
+# routes._log_usage logs one line per moderation call on "palisade.usage". At startup
+# that logger gets a QueueHandler, so handlers only enqueue and a listener thread does
+# the stdout writes.
+_usage_log_listener: Optional[logging.handlers.QueueListener] = None
+
+def _start_usage_log_listener() -> None:
+    global _usage_log_listener
+    if _usage_log_listener is not None:
+        return
+    q: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    usage_logger = logging.getLogger("palisade.usage")
+    usage_logger.addHandler(logging.handlers.QueueHandler(q))
+    usage_logger.propagate = False
+    _usage_log_listener = logging.handlers.QueueListener(q, stream)
+    _usage_log_listener.start()
+
+def _stop_usage_log_listener() -> None:
+    global _usage_log_listener
+    if _usage_log_listener is not None:
+        _usage_log_listener.stop()  # flushes queued records
+        usage_logger = logging.getLogger("palisade.usage")
+        for h in list(usage_logger.handlers):
+            if isinstance(h, logging.handlers.QueueHandler):
+                usage_logger.removeHandler(h)
+        usage_logger.propagate = True
+        _usage_log_listener = None
+
+# ===== Lifespan: init DB once per process + list routes; background writers =====
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _log_task
+    _log_task = asyncio.create_task(_drain_logs())
+    _start_usage_log_listener()
+    start_moderation_batcher()
+    start_usage_flusher()
 
-# ===== Startup: init DB once + list routes =====
-@app.on_event("startup")
-async def on_startup():
     try:
         logger.info("Initializing database...")
-        init_db()
+        await init_db_async()
         logger.info("DB initialized.")
     except Exception:
         logger.exception("DB init failed (continuing; routes may still work).")
@@ -51,10 +141,39 @@ async def on_startup():
     except Exception:
         logger.exception("Failed to print routes")
 
+    yield
+
+    await stop_moderation_batcher()
+    await stop_usage_flusher()
+    _stop_usage_log_listener()
+    await _stop_log_writer()
+    # Writers are done: close pooled connections instead of leaving them to the GC
+    await async_engine.dispose()
+    engine.dispose()
+    await openai_client.close()
+
+app = FastAPI(
+    title="Palisade Moderation API",
+    description="Real-time, contextual moderation for text and image content. Built for speed, accuracy, and developer ease.",
+    version="1.2.0",
+    lifespan=lifespan,
+)
+
+# CORS (keep permissive for now; tighten later)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
 # ===== Middleware for request ID + structured logging =====
+RESPONSE_PREVIEW_BYTES = 1000
+
 class LoggingMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
+        start_time = time.perf_counter()
         req_id = request.headers.get("x-request-id") or str(uuid.uuid4())
         request.state.request_id = req_id  # make available downstream
 
@@ -64,11 +183,12 @@ class LoggingMiddleware(BaseHTTPMiddleware):
             async def receive():
                 return {"type": "http.request", "body": body_bytes, "more_body": False}
             request._receive = receive  # type: ignore
-            body_preview = body_bytes[:2000].decode("utf-8", errors="ignore") if body_bytes else ""
+            body_preview = body_bytes[:2000]
         except Exception:
-            body_preview = ""
+            body_preview = b""
 
-        logger.info(json.dumps({
+        # One record per request: request fields now, response fields once it completes
+        record = {
             "event": "request",
             "request_id": req_id,
             "method": request.method,
@@ -77,31 +197,40 @@ class LoggingMiddleware(BaseHTTPMiddleware):
             "client": request.client.host if request.client else None,
             "has_api_key": "x-api-key" in request.headers,
             "body_preview": body_preview
-        }))
+        }
 
         try:
             response = await call_next(request)
 
-            # Capture response body for logging
-            resp_body = b""
-            async for chunk in response.body_iterator:
-                resp_body += chunk
-            response.body_iterator = iterate_in_threadpool(iter([resp_body]))
-
-            duration_ms = int((time.time() - start_time) * 1000)
-            logger.info(json.dumps({
-                "event": "response",
-                "request_id": req_id,
-                "status_code": response.status_code,
-                "duration_ms": duration_ms,
-                "response_preview": resp_body[:1000].decode("utf-8", errors="ignore")
-            }))
+            # Tee a bounded preview while the body streams through unchanged; the
+            # record is logged once the last chunk has been sent.
+            preview = bytearray()
+            body_iterator = response.body_iterator
+            status_code = response.status_code
+
+            async def tee():
+                try:
+                    async for chunk in body_iterator:
+                        if len(preview) < RESPONSE_PREVIEW_BYTES:
+                            preview.extend(chunk[: RESPONSE_PREVIEW_BYTES - len(preview)])
+                        yield chunk
+                finally:
+                    record.update({
+                        "status_code": status_code,
+                        "duration_ms": int((time.perf_counter() - start_time) * 1000),
+                        "response_preview": preview
+                    })
+                    _enqueue_log(record)
+
+            response.body_iterator = tee()
 
             response.headers["x-request-id"] = req_id
             return response
         except Exception:
-            duration_ms = int((time.time() - start_time) * 1000)
+            duration_ms = int((time.perf_counter() - start_time) * 1000)
             logger.exception("Unhandled error")
+            record.update({"status_code": 500, "duration_ms": duration_ms})
+            _enqueue_log(record)
             return JSONResponse(
                 status_code=500,
                 content={"detail": "Internal Server Error", "request_id": req_id, "duration_ms": duration_ms},
@@ -115,64 +244,84 @@ app.include_router(router)        # /moderate/*
 app.include_router(keys_router)
 app.include_router(admin_router)
 # /keys/* (create/revoke/etc.)
+# Starlette matches routes in registration order, so keys_router's signup-secret
+# admin routes win on the paths they share with admin_router and with main:
+#   GET /admin/keys  -> routes_keys.admin_list (routes_admin.list_keys is unreachable)
+#   GET /admin/logs  -> routes_keys.admin_logs (routes_admin.list_logs and
+#                       get_logs below are unreachable)
+# The dashboard at /admin sends X-Admin-Token, so its keys and logs tabs get 401 there.
 
 # ===== Admin logs API =====
 def verify_admin(request: Request):
     token = request.query_params.get("admin_token")
-    if token != ADMIN_TOKEN:
+    if not token or not hmac.compare_digest(token.encode(), (settings().admin_token or "").encode()):
         raise HTTPException(status_code=403, detail="Forbidden")
 
-@app.get("/admin/logs")
-def get_logs(_: str = Depends(verify_admin)):
-    db = SessionLocal()
-    try:
-        rows = (
-            db.query(RequestLog, ApiKey.email)
-            .join(ApiKey, RequestLog.api_key_id == ApiKey.id, isouter=True)
-            .order_by(RequestLog.created_at.desc())
-            .limit(500)
-            .all()
-        )
-        return [
-            {
-                "email": email or "(no email)",
-                "endpoint": r.endpoint,
-                "status_code": r.status_code,
-                "duration_ms": r.duration_ms,
-                "payload": json.loads(r.payload_json or "{}"),
-                "created_at": r.created_at.isoformat() if hasattr(r, "created_at") and r.created_at else None
-            }
-            for r, email in rows
-        ]
-    finally:
-        db.close()
+ADMIN_LOGS_LIMIT = 500
+
+# Built once at import so the engine's compiled-statement cache is hit on every poll
+_LOGS_STMT = (
+    select(RequestLog, ApiKey.name)
+    .outerjoin(ApiKey, RequestLog.api_key_id == ApiKey.id)
+    .order_by(RequestLog.created_at.desc())
+    .limit(bindparam("lim"))
+)
+
+class AdminLogEntry(BaseModel):
+    email: str
+    endpoint: Optional[str]
+    status_code: Optional[int]
+    duration_ms: Optional[int]
+    payload: Any
+    created_at: Optional[str]
+
+def _load_payload(payload):
+    # SQLite stores the result as text; rows that aren't valid JSON are returned as the raw string
+    if isinstance(payload, str) and payload:
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            return payload
+    return payload or {}
+
+def _serialize_logs(rows) -> list:
+    return [{
+        "email": owner or "(no email)",
+        "endpoint": r.endpoint,
+        "status_code": r.status_code,
+        "duration_ms": r.duration_ms,
+        "payload": _load_payload(r.moderation_result),
+        "created_at": r.created_at.isoformat() if r.created_at else None
+    } for r, owner in rows]
+
+# response_model: FastAPI serializes the rows straight to JSON bytes through Pydantic.
+# Shadowed by routes_keys.admin_logs (see "Mount routers"); /admin/data serves the same rows.
+@app.get("/admin/logs", response_model=List[AdminLogEntry])
+async def get_logs(db: AsyncSession = Depends(get_async_db), _: str = Depends(verify_admin)):
+    rows = (await db.execute(_LOGS_STMT, {"lim": ADMIN_LOGS_LIMIT})).all()
+    return _serialize_logs(rows)
 
 # ===== Health =====
 @app.get("/", tags=["Health"])
 def health():
     return {"status": "ok"}
 
-# (keeping your /admin/data as-is)
-@app.get("/admin/data", response_class=JSONResponse)
-async def admin_data():
+@app.get("/admin/data", response_model=List[AdminLogEntry])
+async def admin_data(db: AsyncSession = Depends(get_async_db), _: str = Depends(verify_admin)):
     """
     Returns the latest request logs for the admin dashboard.
     """
-    # ... your existing implementation ...
-    db: Session = SessionLocal()
-    try:
-        # NOTE: your original code referenced select/pyjson; keep your existing logic here.
-        # (Left unchanged per your request)
-        pass
-    finally:
-        db.close()
+    rows = (await db.execute(_LOGS_STMT, {"lim": ADMIN_LOGS_LIMIT})).all()
+    return _serialize_logs(rows)
 
 # ===== Static admin UI (NEW) =====
 # Serve /static/* and return static/admin.html at /admin
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
 BASE_DIR = pathlib.Path(__file__).parent.resolve()
+STATIC_DIR = BASE_DIR / "static"
+ADMIN_HTML = STATIC_DIR / "admin.html"  # resolved once; FileResponse streams it via sendfile
+
+app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 @app.get("/admin", include_in_schema=False)
 def admin_ui():
-    return FileResponse(BASE_DIR / "static" / "admin.html")
+    return FileResponse(ADMIN_HTML)
@@ -1,6 +1,55 @@
 # Simple migration script to create Palisade tables
-from db import init_db
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from db import init_db, engine
+
+# Postgres only: trigram GIN indexes so the admin substring searches
+# (lower(col) LIKE lower('%q%')) are index probes instead of sequential scans.
+# endpoint is only ever matched exactly, which the btree index serves.
+# CONCURRENTLY builds without blocking log inserts; it can't run inside a transaction.
+_PG_TRGM_INDEXES = (
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_palisade_request_logs_result_trgm "
+    "ON palisade_request_logs USING gin (lower(CAST(moderation_result AS TEXT)) gin_trgm_ops)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_palisade_api_keys_name_trgm "
+    "ON palisade_api_keys USING gin (lower(name) gin_trgm_ops)",
+)
+
+def create_trgm_indexes():
+    if engine.dialect.name != "postgresql":
+        return
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for ddl in _PG_TRGM_INDEXES:
+                conn.execute(text(ddl))
+    except DBAPIError as e:
+        # e.g. no privilege to create the extension; searches still work, just unindexed.
+        # A failed concurrent build leaves an INVALID index: drop it before re-running.
+        print(f"pg_trgm indexes not created: {e}")
+
+# Postgres only: keep log rows narrow. moderation_result is usually under the default
+# ~2 KB TOAST threshold, so it sits inline and every list scan reads past it. A low
+# toast_tuple_target moves it out of line (list views only project the hot columns),
+# and lz4 (PG 14+) makes compressing/decompressing those values cheap.
+# One-time DDL that takes locks on the log table, so it runs here, not at app startup.
+_PG_LOG_STORAGE_DDL = (
+    "ALTER TABLE palisade_request_logs SET (toast_tuple_target = 256)",
+    "ALTER TABLE palisade_request_logs ALTER COLUMN moderation_result SET COMPRESSION lz4",
+)
+
+def tune_log_storage():
+    if engine.dialect.name != "postgresql":
+        return
+    for ddl in _PG_LOG_STORAGE_DDL:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(ddl))
+        except DBAPIError as e:
+            # older server / no lz4 support; storage stays at the defaults
+            print(f"Log storage tuning skipped ({ddl}): {e}")
 
 if __name__ == "__main__":
     init_db()
-    print("Palisade DB tables created (or already exist).")
\ No newline at end of file
+    create_trgm_indexes()
+    tune_log_storage()
+    print("Palisade DB tables created (or already exist).")
@@ -1,41 +1,64 @@
 from fastapi import APIRouter, HTTPException, Security, Depends, Request
 from fastapi.security import APIKeyHeader
-from pydantic import BaseModel
-from typing import List, Optional, Any, Dict
+from sqlalchemy import JSON, insert
+from pydantic import BaseModel, Field
+from typing import List, Optional, Any, Dict, Iterable, Iterator, Tuple
+import asyncio
+import hashlib
+import httpx
+import logging
+import msgspec
+import threading
+from collections import OrderedDict
+from cachetools import TTLCache
 import openai
-import json
+import orjson
 import time
-import re
 
+from batching import next_batch
 from config import OPENAI_API_KEY, PALISADE_API_KEYS, RATE_LIMIT_RPM
-from db import SessionLocal, ApiKey, RequestLog, init_db
-from key_utils import hash_key
+from db import SessionLocal, AsyncSessionLocal, RequestLog
+from deps import resolve_key
+from key_utils import key_digest, get_cached_key
 
 router = APIRouter()
-# Add a sane timeout so requests don't hang forever
-client = openai.OpenAI(api_key=OPENAI_API_KEY, timeout=15.0)
+logger = logging.getLogger("palisade.routes")
+# One breadcrumb per moderation call; main wires this to a queue-backed handler
+usage_logger = logging.getLogger("palisade.usage")
+# One shared client: concurrent moderation calls multiplex over a single pooled
+# HTTP/2 connection set. Timeout keeps requests from hanging forever.
+client = openai.AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    timeout=15.0,
+    max_retries=2,
+    http_client=httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    ),
+)
 
 # ==== API Key Auth ====
 api_key_header = APIKeyHeader(name="x-api-key", auto_error=False)
+# O(1) membership for the legacy env-based keys
+_ENV_KEYS: frozenset = frozenset(PALISADE_API_KEYS or ())
 
-def get_api_key(request: Request, api_key: str = Security(api_key_header)) -> str:
-    init_db()
-    # 1) Try DB-backed keys
+async def get_api_key(request: Request, api_key: str = Security(api_key_header)) -> str:
+    # 1) Try DB-backed keys (cached both ways: matches for 60s, misses for 10s)
     if api_key:
-        db = SessionLocal()
-        try:
-            rows = db.query(ApiKey).filter(ApiKey.is_active == True).all()
-            for rec in rows:
-                if hash_key(rec.key_salt, api_key) == rec.key_hash:
-                    request.state.api_key_id = rec.id
-                    return api_key
-        finally:
-            db.close()
+        cached = get_cached_key(key_digest(api_key))
+        if cached and cached[1]:
+            request.state.api_key_id = cached[0]
+            return api_key
+        async with AsyncSessionLocal() as db:
+            rec = await resolve_key(db, api_key)
+        if rec is not None:
+            request.state.api_key_id = rec.id
+            return api_key
     # 2) Fallback to env-based keys (legacy/testing)
-    if not PALISADE_API_KEYS:
+    if not _ENV_KEYS:
         request.state.api_key_id = None  # dev mode
         return "dev-mode"
-    if api_key and api_key in PALISADE_API_KEYS:
+    if api_key and api_key in _ENV_KEYS:
         request.state.api_key_id = None
         return api_key
     raise HTTPException(status_code=401, detail="Invalid or missing API key")
@@ -44,35 +67,50 @@ def get_api_key(request: Request, api_key: str = Security(api_key_header)) -> st
 RATE_LIMIT_RPM = max(1, int(RATE_LIMIT_RPM))
 RATE_LIMIT_BURST = max(1, int(max(1, RATE_LIMIT_RPM // 2)))  # allow short bursts
 
-_buckets: Dict[str, Any] = {}
+# LRU-bounded so unseen/rotating keys can't grow memory without limit; the lock
+# covers the read-modify-write since sync dependencies run in the threadpool.
+RATE_LIMIT_MAX_KEYS = 100_000
+_buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+_buckets_lock = threading.Lock()
+
 def rate_limit(request: Request, api_key: str = Depends(get_api_key)):
-    now = time.time()
+    now = time.monotonic()
     window_seconds = 60.0
     capacity = RATE_LIMIT_BURST
     refill_per_sec = RATE_LIMIT_RPM / window_seconds  # tokens/sec
 
-    tokens, last = _buckets.get(api_key, (capacity, now))
-    tokens = min(capacity, tokens + (now - last) * refill_per_sec)
-    if tokens < 1.0:
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
-    _buckets[api_key] = (tokens - 1.0, now)
+    with _buckets_lock:
+        tokens, last = _buckets.get(api_key, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * refill_per_sec)
+        if tokens < 1.0:
+            raise HTTPException(status_code=429, detail="Rate limit exceeded")
+        _buckets[api_key] = (tokens - 1.0, now)
+        _buckets.move_to_end(api_key)
+        if len(_buckets) > RATE_LIMIT_MAX_KEYS:
+            _buckets.popitem(last=False)
     return api_key
 
 # ==== INPUT MODELS ====
+# Length caps are enforced while parsing, so oversized payloads never reach a handler
+MAX_TEXT_CHARS = 50_000
+MAX_IMAGE_URL_CHARS = 4_096
+MAX_MESSAGE_CHARS = 8_000
+MAX_MESSAGES = 500
+
 class TextInput(BaseModel):
-    text: str
+    text: str = Field(..., max_length=MAX_TEXT_CHARS)
 
 class ImageInput(BaseModel):
-    image_url: str
+    image_url: str = Field(..., max_length=MAX_IMAGE_URL_CHARS)
 
 class Message(BaseModel):
     sender_id: str
-    content: str
+    content: str = Field(..., max_length=MAX_MESSAGE_CHARS)
     timestamp: Optional[str] = None
 
 class ContextualInput(BaseModel):
     conversation_id: str
-    messages: List[Message]
+    messages: List[Message] = Field(..., max_length=MAX_MESSAGES)
 
 # ==== RESPONSE MODELS ====
 class TextModerationResponse(BaseModel):
@@ -92,23 +130,148 @@ class ContextualModerationResponse(BaseModel):
     risk_factors: List[str]
     suggested_action: str
 
+# ==== Model output shapes (decoded directly, no intermediate dict) ====
+# safe has no default: output without a verdict never counts as a clean decode
+class _ImageResult(msgspec.Struct):
+    safe: bool
+    categories: List[str] = []
+    confidence: float = 0.0
+    suggested_action: str = "allow"
+
+class _ContextResult(msgspec.Struct):
+    safe: bool
+    risk_factors: List[str] = []
+    suggested_action: str = "allow"
+
+# strict=False keeps the old leniency for e.g. "confidence": "0.9"
+_IMAGE_DECODER = msgspec.json.Decoder(_ImageResult, strict=False)
+_CONTEXT_DECODER = msgspec.json.Decoder(_ContextResult, strict=False)
+
+# ==== Model prompts (built once; handlers only add the user message) ====
+_IMAGE_SYS_PROMPT = (
+    "You are a content moderation system. Analyze the image and return ONLY a JSON object with:\n"
+    "{"
+    "\"safe\": true/false, "
+    "\"categories\": [\"string\"], "
+    "\"confidence\": 0.0-1.0, "
+    "\"suggested_action\": \"allow/escalate/block\""
+    "}\n"
+    "No extra text."
+).strip()
+_IMAGE_SYS_MSG = {"role": "system", "content": _IMAGE_SYS_PROMPT}
+_IMAGE_USER_TEXT = {"type": "text", "text": "Moderate this image:"}
+
+_CTX_SYS_PROMPT = (
+    "You are a trust & safety analyst. Analyze the following conversation for grooming, manipulation, "
+    "harassment, power imbalance, or any kind of risk.\n\n"
+    "Return only a JSON object with:\n"
+    "{"
+    "\"safe\": true/false, "
+    "\"risk_factors\": [\"string\"], "
+    "\"suggested_action\": \"allow/escalate/block\""
+    "}\n\n"
+    "DO NOT include any explanation. ONLY return the JSON."
+).strip()
+_CTX_SYS_MSG = {"role": "system", "content": _CTX_SYS_PROMPT}
+
 # ==== Helpers ====
+_HTTP_PREFIXES = ("http://", "https://")
+
+def _find_json_object(s: str) -> Optional[str]:
+    """Return the first balanced {...} substring, ignoring braces inside string literals. O(n)."""
+    depth = 0
+    start = 0
+    in_string = False
+    escaped = False
+    for i, ch in enumerate(s):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            # Quotes only matter inside an object; prose before it is skipped
+            in_string = depth > 0
+        elif ch == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                return s[start:i + 1]
+    return None
+
 def _extract_json(text: str) -> Dict[str, Any]:
     """Pull the first JSON object from a model response. Falls back to {}."""
     if not text:
         return {}
     try:
-        return json.loads(text)
+        return orjson.loads(text)
     except Exception:
         pass
-    m = re.search(r'\{(?:[^{}]|(?R))*\}', text, flags=re.DOTALL)
-    if m:
+    candidate = _find_json_object(text)
+    if candidate:
         try:
-            return json.loads(m.group(0))
+            return orjson.loads(candidate)
         except Exception:
             return {}
     return {}
 
+def _decode_fields(result_type: type, parsed: Any):
+    """Per-field fallback: a field that doesn't convert keeps its default, the rest are kept.
+
+    Fails closed: safe is True only when the model's value converts to a boolean True.
+    A missing or unconvertible verdict ("no", "unsafe", null, a list...) is unsafe and
+    escalated, unless the model itself asked to block.
+    """
+    if not isinstance(parsed, dict):
+        parsed = {}
+    values = {}
+    for f in msgspec.structs.fields(result_type):
+        if f.name in parsed:
+            try:
+                values[f.name] = msgspec.convert(parsed[f.name], type=f.type, strict=False)
+            except msgspec.ValidationError:
+                pass
+    if "safe" not in values:
+        values["safe"] = False
+        if values.get("suggested_action") != "block":
+            values["suggested_action"] = "escalate"
+    return result_type(**values)
+
+def _decode_result(decoder: msgspec.json.Decoder, result_type: type, text: Optional[str]):
+    """Decode model output into result_type; non-pure-JSON output goes through _extract_json.
+
+    Returns (result, clean). clean is False when any field needed the per-field fallback.
+    """
+    if text:
+        try:
+            return decoder.decode(text), True
+        except msgspec.DecodeError:
+            pass
+    parsed = _extract_json(text)
+    try:
+        return msgspec.convert(parsed, type=result_type, strict=False), True
+    except msgspec.ValidationError:
+        return _decode_fields(result_type, parsed), False
+
+def _utf8_len(s: Optional[str]) -> int:
+    """UTF-8 byte length; ASCII strings (the common case) are measured without encoding."""
+    if not s:
+        return 0
+    return len(s) if s.isascii() else len(s.encode("utf-8", "surrogatepass"))
+
+def _safe_floats(values: Iterable[Any]) -> Iterator[float]:
+    """Yield each value as a float, skipping anything that doesn't convert."""
+    for v in values:
+        try:
+            yield float(v)
+        except Exception:
+            continue
+
 def _as_dict(x) -> Dict[str, Any]:
     """Coerce SDK objects (e.g., pydantic models) to dicts safely."""
     if x is None:
@@ -119,14 +282,85 @@ def _as_dict(x) -> Dict[str, Any]:
         return x.model_dump()
     if hasattr(x, "to_dict") and callable(x.to_dict):
         return x.to_dict()
+    # Instance attributes only: dir() walks the whole MRO and triggers descriptors.
+    # Values come straight from __dict__, so each attribute is read once.
+    if not hasattr(x, "__dict__"):
+        return {}
+    return {k: v for k, v in vars(x).items() if not k.startswith("_") and not callable(v)}
+
+# ==== Usage log writer ====
+# _log_usage only enqueues; a background task drains the queue and writes each batch
+# as one executemany INSERT on the async engine, so handlers never wait on a commit.
+# Rows are dropped (best-effort, as before) if the queue is full.
+USAGE_LOG_QUEUE_MAX = 10_000
+USAGE_LOG_BATCH_SIZE = 500
+USAGE_LOG_BATCH_WAIT_S = 0.1
+
+# SQLite stores the result as Text; JSON columns take the dict directly
+_RESULT_AS_TEXT = not isinstance(RequestLog.__table__.c.moderation_result.type, JSON)
+# One statement for every batch size, so it's compiled and cached once
+_USAGE_INSERT = insert(RequestLog)
+
+_usage_q: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=USAGE_LOG_QUEUE_MAX)
+_usage_task: Optional[asyncio.Task] = None
+# Queued last by stop_usage_flusher; everything ahead of it is written first
+_USAGE_STOP = object()
+
+def _write_usage_batch_sync(batch: List[Dict[str, Any]]) -> None:
+    """Fallback for when the writer task isn't running (scripts, no lifespan)."""
     try:
-        return {
-            k: getattr(x, k)
-            for k in dir(x)
-            if not k.startswith("_") and not callable(getattr(x, k, None))
-        }
+        with SessionLocal() as db:
+            db.execute(_USAGE_INSERT, batch)
+            db.commit()
     except Exception:
-        return {}
+        logger.exception("Failed to write %d usage log rows", len(batch))
+
+def _write_usage_inline(row: Dict[str, Any]) -> None:
+    # Called from async handlers: keep the blocking write off the event loop
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _write_usage_batch_sync([row])
+        return
+    loop.run_in_executor(None, _write_usage_batch_sync, [row])
+
+async def _write_usage_batch(batch: List[Dict[str, Any]]) -> None:
+    try:
+        # executemany: one round trip and one commit per batch
+        async with AsyncSessionLocal() as db:
+            await db.execute(_USAGE_INSERT, batch)
+            await db.commit()
+    except Exception:
+        logger.exception("Failed to write %d usage log rows", len(batch))
+
+async def _usage_flusher():
+    while True:
+        batch = await next_batch(_usage_q, USAGE_LOG_BATCH_SIZE, USAGE_LOG_BATCH_WAIT_S, _USAGE_STOP)
+        stopping = batch[-1] is _USAGE_STOP
+        if stopping:
+            batch.pop()
+        if batch:
+            await _write_usage_batch(batch)
+        if stopping:
+            return
+
+def start_usage_flusher() -> None:
+    global _usage_task
+    if _usage_task is None:
+        _usage_task = asyncio.create_task(_usage_flusher())
+
+async def stop_usage_flusher(timeout: float = 5.0) -> None:
+    """Write pending rows and stop the writer task."""
+    global _usage_task
+    task, _usage_task = _usage_task, None
+    if task is None:
+        return
+    # Later _log_usage calls take the fallback writer, so the stop marker is always last in the queue
+    await _usage_q.put(_USAGE_STOP)
+    try:
+        await asyncio.wait_for(task, timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        pass
 
 def _log_usage(
     api_key_id: Optional[int],
@@ -138,24 +372,26 @@ def _log_usage(
 ) -> None:
     """Best-effort logging to DB; never throws."""
     try:
-        db = SessionLocal()
-        try:
-            payload_json = json.dumps(details, separators=(",", ":"), ensure_ascii=False)
-            log = RequestLog(
-                api_key_id=api_key_id,
-                endpoint=endpoint,
-                size_bytes=size_bytes,
-                status_code=status_code,
-                duration_ms=duration_ms,
-                payload_json=payload_json,  # adjust if your column name differs
-            )
-            db.add(log)
-            db.commit()
-        finally:
-            db.close()
+        row = {
+            "api_key_id": api_key_id,
+            "endpoint": endpoint,
+            "request_size_bytes": size_bytes,
+            "status_code": status_code,
+            "duration_ms": duration_ms,
+            "moderation_result": (
+                orjson.dumps(details).decode() if _RESULT_AS_TEXT else details
+            ),
+        }
+        if _usage_task is None:
+            _write_usage_inline(row)
+        else:
+            _usage_q.put_nowait(row)
     except Exception:
         pass
-    print(f"[LOG] api_key_id={api_key_id} endpoint={endpoint} status={status_code} size={size_bytes} duration_ms={duration_ms}")
+    usage_logger.info(
+        "api_key_id=%s endpoint=%s status=%s size=%s duration_ms=%s",
+        api_key_id, endpoint, status_code, size_bytes, duration_ms,
+    )
 
 # ---- OpenAI error mapping → consistent HTTP codes ----
 def _map_openai_error(e: Exception) -> HTTPException:
@@ -181,21 +417,154 @@ def _map_openai_error(e: Exception) -> HTTPException:
         pass
     return HTTPException(500, "Unexpected moderation error")
 
+# ==== Moderation batching ====
+# Concurrent /moderate/text calls are coalesced into one moderations.create(input=[...]).
+MODERATION_MODEL = "omni-moderation-latest"
+MODERATION_BATCH_SIZE = 32
+MODERATION_BATCH_WAIT_S = 0.01
+
+_moderation_queue: "asyncio.Queue[Any]" = asyncio.Queue()
+_moderation_task: Optional[asyncio.Task] = None
+_moderation_inflight: set = set()
+# Queued last by stop_moderation_batcher; everything ahead of it is still sent upstream
+_MODERATION_STOP = object()
+
+def _fail_batch(batch: list, e: BaseException) -> None:
+    for _, fut in batch:
+        if not fut.done():
+            fut.set_exception(e)
+
+# 4xx statuses that can come from one input rather than the whole request; 401/403/429
+# apply to every caller alike, so retrying per item would only multiply the calls
+_PER_INPUT_STATUS = frozenset((400, 404, 409, 413, 422))
+
+def _is_per_input_error(e: Exception) -> bool:
+    return isinstance(e, openai.APIStatusError) and e.status_code in _PER_INPUT_STATUS
+
+async def _run_moderation_batch(batch: list) -> None:
+    try:
+        resp = await client.moderations.create(
+            model=MODERATION_MODEL,
+            input=[text for text, _ in batch]
+        )
+        results = list(resp.results)
+        if len(results) != len(batch):
+            raise RuntimeError("moderation batch result count mismatch")
+    except asyncio.CancelledError:
+        # Cancelled at shutdown: fail the waiters rather than leave them hanging
+        _fail_batch(batch, RuntimeError("moderation batcher stopped"))
+        raise
+    except Exception as e:
+        if len(batch) > 1 and _is_per_input_error(e):
+            # One caller's bad input must not fail the others: retry each input alone
+            await asyncio.gather(*(_run_moderation_batch([item]) for item in batch))
+            return
+        _fail_batch(batch, e)
+        return
+    for (_, fut), result in zip(batch, results):
+        if not fut.done():
+            fut.set_result(result)
+
+async def _moderation_batcher():
+    while True:
+        batch = await next_batch(_moderation_queue, MODERATION_BATCH_SIZE, MODERATION_BATCH_WAIT_S, _MODERATION_STOP)
+        stopping = batch[-1] is _MODERATION_STOP
+        if stopping:
+            batch.pop()
+        if batch:
+            # Don't hold the next batch behind this one's upstream round trip
+            task = asyncio.create_task(_run_moderation_batch(batch))
+            _moderation_inflight.add(task)
+            task.add_done_callback(_moderation_inflight.discard)
+        if stopping:
+            return
+
+def start_moderation_batcher() -> None:
+    global _moderation_task
+    if _moderation_task is None:
+        _moderation_task = asyncio.create_task(_moderation_batcher())
+
+async def stop_moderation_batcher(timeout: float = 5.0) -> None:
+    """Send queued inputs upstream, wait for in-flight batches and stop the batcher task.
+
+    Whatever is still unresolved after timeout fails, so no handler hangs at shutdown.
+    """
+    global _moderation_task
+    task, _moderation_task = _moderation_task, None
+    if task is None:
+        return
+    # Later _moderate calls go straight upstream, so the stop marker is always last in the queue
+    _moderation_queue.put_nowait(_MODERATION_STOP)
+    try:
+        await asyncio.wait_for(task, timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        pass
+    if _moderation_inflight:
+        await asyncio.wait(set(_moderation_inflight), timeout=timeout)
+    leftover = set(_moderation_inflight)
+    for t in leftover:
+        t.cancel()
+    if leftover:
+        await asyncio.gather(*leftover, return_exceptions=True)
+    stopped = RuntimeError("moderation batcher stopped")
+    while not _moderation_queue.empty():
+        item = _moderation_queue.get_nowait()
+        if item is not _MODERATION_STOP:
+            _fail_batch([item], stopped)
+
+async def _moderate(text: str):
+    """Return the moderation result for one input, batched when the batcher is running."""
+    if _moderation_task is None:
+        resp = await client.moderations.create(model=MODERATION_MODEL, input=text)
+        return resp.results[0]
+    fut = asyncio.get_running_loop().create_future()
+    _moderation_queue.put_nowait((text, fut))
+    return await fut
+
+# ==== Moderation response cache ====
+# Identical inputs (retries, duplicates, bots) are answered without an upstream call.
+# Only successful responses are stored, and image/contextual verdicts only when the
+# model output decoded cleanly; errors and fallback verdicts always go back to the model.
+MODERATION_CACHE_TTL_S = 600
+_mod_cache: TTLCache = TTLCache(maxsize=10_000, ttl=MODERATION_CACHE_TTL_S)
+_mod_cache_lock = threading.Lock()
+
+def _mod_cache_key(endpoint: str, payload: str) -> Tuple[str, bytes]:
+    return endpoint, hashlib.blake2b(payload.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+def _get_cached_response(key: Tuple[str, bytes]) -> Optional[Dict[str, Any]]:
+    with _mod_cache_lock:
+        return _mod_cache.get(key)
+
+def _cache_response(key: Tuple[str, bytes], response: Dict[str, Any]) -> None:
+    with _mod_cache_lock:
+        _mod_cache[key] = response
+
 # ==== ROUTES: TEXT ====
 @router.post("/moderate/text", response_model=TextModerationResponse)
 async def moderate_text(request: Request, input: TextInput, api_key: str = Depends(rate_limit)):
-    t0 = time.time()
+    t0 = time.perf_counter()
     endpoint = "/moderate/text"
     try:
         # Input validation
         if not input.text or not input.text.strip():
             raise HTTPException(400, "text is required")
 
-        resp = client.moderations.create(
-            model="omni-moderation-latest",
-            input=input.text
-        )
-        r = resp.results[0]
+        log_input = {"text_preview": input.text[:2000]}
+        mod_key = _mod_cache_key(endpoint, input.text)
+        cached = _get_cached_response(mod_key)
+        if cached is not None:
+            _log_usage(
+                getattr(request.state, "api_key_id", None),
+                endpoint,
+                _utf8_len(input.text),
+                200,
+                int((time.perf_counter() - t0) * 1000),
+                {"input": log_input, "response": cached, "cache_hit": True},
+            )
+            return cached
+
+        r = await _moderate(input.text)
         flagged = bool(getattr(r, "flagged", False))
 
         # Coerce SDK objects to dicts safely
@@ -203,50 +572,39 @@ async def moderate_text(request: Request, input: TextInput, api_key: str = Depen
         cats = [k for k, v in categories_dict.items() if bool(v)]
 
         scores_dict = _as_dict(getattr(r, "category_scores", None))
-        numeric_scores: List[float] = []
-        for v in scores_dict.values():
-            try:
-                numeric_scores.append(float(v))
-            except Exception:
-                pass
-        confidence = float(max(numeric_scores)) if numeric_scores else (1.0 if flagged else 0.0)
+        confidence = max(_safe_floats(scores_dict.values()), default=(1.0 if flagged else 0.0))
 
         suggested_action = "allow"
         if flagged:
             suggested_action = "block" if confidence >= 0.9 else "escalate"
 
-        duration_ms = int((time.time() - t0) * 1000)
-        size_est = len((input.text or "").encode("utf-8"))
+        response = {
+            "safe": not flagged,
+            "categories": cats,
+            "confidence": confidence,
+            "suggested_action": suggested_action,
+        }
+        _cache_response(mod_key, response)
+
+        duration_ms = int((time.perf_counter() - t0) * 1000)
+        size_est = _utf8_len(input.text)
         _log_usage(
             getattr(request.state, "api_key_id", None),
             endpoint,
             size_est,
             200,
             duration_ms,
-            {
-                "input": {"text_preview": (input.text[:2000] if input.text else "")},
-                "response": {
-                    "safe": not flagged,
-                    "categories": cats,
-                    "confidence": confidence,
-                    "suggested_action": suggested_action,
-                },
-            },
+            {"input": log_input, "response": response},
         )
 
-        return {
-            "safe": not flagged,
-            "categories": cats,
-            "confidence": confidence,
-            "suggested_action": suggested_action,
-        }
+        return response
 
     except HTTPException:
         # Already mapped; still log below in middleware
         raise
     except Exception as e:
-        duration_ms = int((time.time() - t0) * 1000)
-        size_est = len((input.text or "").encode("utf-8")) if input and input.text else 0
+        duration_ms = int((time.perf_counter() - t0) * 1000)
+        size_est = _utf8_len(input.text) if input else 0
         _log_usage(
             getattr(request.state, "api_key_id", None),
             endpoint,
@@ -260,82 +618,71 @@ async def moderate_text(request: Request, input: TextInput, api_key: str = Depen
 # ==== ROUTES: IMAGE ====
 @router.post("/moderate/image", response_model=ImageModerationResponse)
 async def moderate_image(request: Request, input: ImageInput, api_key: str = Depends(rate_limit)):
-    t0 = time.time()
+    t0 = time.perf_counter()
     endpoint = "/moderate/image"
     try:
         # Input validation
         if not input.image_url or not input.image_url.strip():
             raise HTTPException(400, "image_url is required")
-        if not re.match(r"^https?://", input.image_url.strip(), flags=re.I):
+        # Case-insensitive prefix test on the first 8 chars; no regex per request
+        if not input.image_url.strip()[:8].lower().startswith(_HTTP_PREFIXES):
             raise HTTPException(400, "image_url must be http(s)")
 
-        system_prompt = (
-            "You are a content moderation system. Analyze the image and return ONLY a JSON object with:\n"
-            "{"
-            "\"safe\": true/false, "
-            "\"categories\": [\"string\"], "
-            "\"confidence\": 0.0-1.0, "
-            "\"suggested_action\": \"allow/escalate/block\""
-            "}\n"
-            "No extra text."
-        )
+        log_input = {"image_url": input.image_url}
+        mod_key = _mod_cache_key(endpoint, input.image_url)
+        cached = _get_cached_response(mod_key)
+        if cached is not None:
+            _log_usage(
+                getattr(request.state, "api_key_id", None),
+                endpoint,
+                _utf8_len(input.image_url),
+                200,
+                int((time.perf_counter() - t0) * 1000),
+                {"input": log_input, "response": cached, "cache_hit": True},
+            )
+            return cached
 
-        resp = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Moderate this image:"},
-                        {"type": "image_url", "image_url": {"url": input.image_url}},
-                    ],
-                },
+        user_msg = {
+            "role": "user",
+            "content": [
+                _IMAGE_USER_TEXT,
+                {"type": "image_url", "image_url": {"url": input.image_url}},
             ],
+        }
+        resp = await client.chat.completions.create(
+            model="gpt-4o",
+            messages=[_IMAGE_SYS_MSG, user_msg],
             max_tokens=200,
         )
-        result_text = resp.choices[0].message.content
-        parsed = _extract_json(result_text) or {}
+        result, clean = _decode_result(_IMAGE_DECODER, _ImageResult, resp.choices[0].message.content)
 
-        safe = bool(parsed.get("safe", True))
-        categories = parsed.get("categories", [])
-        try:
-            confidence = float(parsed.get("confidence", 0.0))
-        except Exception:
-            confidence = 0.0
-        suggested_action = parsed.get("suggested_action", "allow")
+        response = {
+            "safe": result.safe,
+            "categories": result.categories,
+            "confidence": result.confidence,
+            "suggested_action": result.suggested_action,
+        }
+        if clean:
+            _cache_response(mod_key, response)
 
-        duration_ms = int((time.time() - t0) * 1000)
-        size_est = len((input.image_url or "").encode("utf-8"))
+        duration_ms = int((time.perf_counter() - t0) * 1000)
+        size_est = _utf8_len(input.image_url)
         _log_usage(
             getattr(request.state, "api_key_id", None),
             endpoint,
             size_est,
             200,
             duration_ms,
-            {
-                "input": {"image_url": input.image_url},
-                "response": {
-                    "safe": safe,
-                    "categories": categories,
-                    "confidence": confidence,
-                    "suggested_action": suggested_action,
-                },
-            },
+            {"input": log_input, "response": response},
         )
 
-        return {
-            "safe": safe,
-            "categories": categories,
-            "confidence": confidence,
-            "suggested_action": suggested_action,
-        }
+        return response
 
     except HTTPException:
         raise
     except Exception as e:
-        duration_ms = int((time.time() - t0) * 1000)
-        size_est = len((input.image_url or "").encode("utf-8")) if input and input.image_url else 0
+        duration_ms = int((time.perf_counter() - t0) * 1000)
+        size_est = _utf8_len(input.image_url) if input else 0
         _log_usage(
             getattr(request.state, "api_key_id", None),
             endpoint,
@@ -349,7 +696,7 @@ async def moderate_image(request: Request, input: ImageInput, api_key: str = Dep
 # ==== ROUTES: CONTEXTUAL ====
 @router.post("/moderate/contextual", response_model=ContextualModerationResponse)
 async def moderate_contextual(request: Request, input: ContextualInput, api_key: str = Depends(rate_limit)):
-    t0 = time.time()
+    t0 = time.perf_counter()
     endpoint = "/moderate/contextual"
     try:
         # Input validation
@@ -360,67 +707,62 @@ async def moderate_contextual(request: Request, input: ContextualInput, api_key:
         if not any((m.content or "").strip() for m in input.messages):
             raise HTTPException(400, "at least one message with content is required")
 
-        messages_formatted = "\n".join(
-            [f"{m.timestamp or ''} {m.sender_id}: {m.content}" for m in input.messages]
-        )
+        # One attribute pass per message; the tuples feed the prompt, size and log below
+        msgs = [(m.timestamp or "", m.sender_id, m.content) for m in input.messages]
+        messages_formatted = "\n".join(f"{ts} {sender}: {content}" for ts, sender, content in msgs)
+        size_est = sum(_utf8_len(content) for _, _, content in msgs)
+        log_input = {
+            "conversation_id": input.conversation_id,
+            "messages": [{"sender_id": sender, "content": content} for _, sender, content in msgs[:50]],
+        }
 
-        system_prompt = (
-            "You are a trust & safety analyst. Analyze the following conversation for grooming, manipulation, "
-            "harassment, power imbalance, or any kind of risk.\n\n"
-            "Return only a JSON object with:\n"
-            "{"
-            "\"safe\": true/false, "
-            "\"risk_factors\": [\"string\"], "
-            "\"suggested_action\": \"allow/escalate/block\""
-            "}\n\n"
-            "DO NOT include any explanation. ONLY return the JSON."
-        )
+        # Keyed on the transcript the model sees
+        mod_key = _mod_cache_key(endpoint, messages_formatted)
+        cached = _get_cached_response(mod_key)
+        if cached is not None:
+            _log_usage(
+                getattr(request.state, "api_key_id", None),
+                endpoint,
+                size_est,
+                200,
+                int((time.perf_counter() - t0) * 1000),
+                {"input": log_input, "response": cached, "cache_hit": True},
+            )
+            return cached
 
-        response = client.chat.completions.create(
+        completion = await client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": messages_formatted}
-            ],
+            messages=[_CTX_SYS_MSG, {"role": "user", "content": messages_formatted}],
             max_tokens=400
         )
 
-        result_text = response.choices[0].message.content
-        parsed = _extract_json(result_text) or {}
+        result, clean = _decode_result(_CONTEXT_DECODER, _ContextResult, completion.choices[0].message.content)
 
-        duration_ms = int((time.time() - t0) * 1000)
-        size_est = sum(len((m.content or "").encode("utf-8")) for m in input.messages)
+        response = {
+            "safe": result.safe,
+            "risk_factors": result.risk_factors,
+            "suggested_action": result.suggested_action,
+        }
+        if clean:
+            _cache_response(mod_key, response)
 
+        duration_ms = int((time.perf_counter() - t0) * 1000)
         _log_usage(
             getattr(request.state, "api_key_id", None),
             endpoint,
             size_est,
             200,
             duration_ms,
-            {
-                "input": {
-                    "conversation_id": input.conversation_id,
-                    "messages": [{"sender_id": m.sender_id, "content": m.content} for m in input.messages][:50],
-                },
-                "response": {
-                    "safe": bool(parsed.get("safe", True)),
-                    "risk_factors": parsed.get("risk_factors", []),
-                    "suggested_action": parsed.get("suggested_action", "allow"),
-                },
-            },
+            {"input": log_input, "response": response},
         )
 
-        return {
-            "safe": bool(parsed.get("safe", True)),
-            "risk_factors": parsed.get("risk_factors", []),
-            "suggested_action": parsed.get("suggested_action", "allow"),
-        }
+        return response
 
     except HTTPException:
         raise
     except Exception as e:
-        duration_ms = int((time.time() - t0) * 1000)
-        size_est = sum(len((m.content or "").encode("utf-8")) for m in input.messages) if input and input.messages else 0
+        duration_ms = int((time.perf_counter() - t0) * 1000)
+        size_est = sum(_utf8_len(m.content) for m in input.messages) if input and input.messages else 0
         _log_usage(
             getattr(request.state, "api_key_id", None),
             endpoint,
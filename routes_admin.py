@@ -1,40 +1,71 @@
 # routes_admin.py
 from fastapi import APIRouter, Depends, HTTPException, Request, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, cast, or_, and_
+from sqlalchemy.types import Text
+from sqlalchemy.dialects.postgresql import distinct_on
 from typing import Optional, List, Dict, Any
-from db import SessionLocal, ApiKey, RequestLog
+from db import get_async_db, ApiKey, RequestLog
 from config import ADMIN_TOKEN
 import datetime as dt
+import hmac
 import uuid
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 def require_admin(request: Request):
     token = request.headers.get("X-Admin-Token")
-    if not token or token != ADMIN_TOKEN:
+    if not token or not hmac.compare_digest(token.encode(), (ADMIN_TOKEN or "").encode()):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-@router.get("/users")
-def list_users(q: Optional[str] = None, db: Session = Depends(get_db), _: None = Depends(require_admin)):
-    # group by email from ApiKey
-    query = db.query(ApiKey.email, func.count(ApiKey.id).label("key_count"), func.min(ApiKey.created_at).label("created_at"))\
-              .group_by(ApiKey.email)
+USERS_PAGE = 200
+
+async def _list_users_pg(db: AsyncSession, q: Optional[str]):
+    """DISTINCT ON picks each owner's first key without aggregating the table; counts
+    are then taken only for the page of owners actually returned."""
+    firsts = (
+        select(ApiKey.name, ApiKey.created_at)
+        .ext(distinct_on(ApiKey.name))
+        .order_by(ApiKey.name, ApiKey.created_at)
+    )
     if q:
-        query = query.having(ApiKey.email.ilike(f"%{q}%"))
-    rows = query.order_by(func.min(ApiKey.created_at).desc()).limit(200).all()
+        firsts = firsts.where(func.lower(ApiKey.name).like(func.lower(f"%{q}%")))
+    firsts = firsts.subquery()
+    page = (await db.execute(
+        select(firsts.c.name, firsts.c.created_at).order_by(firsts.c.created_at.desc()).limit(USERS_PAGE)
+    )).all()
+    if not page:
+        return []
+    names = [r.name for r in page]
+    # IN never matches NULL; unnamed keys are one group, as in the GROUP BY path
+    in_page = ApiKey.name.in_([n for n in names if n is not None])
+    if None in names:
+        in_page = or_(in_page, ApiKey.name.is_(None))
+    counts = dict((await db.execute(
+        select(ApiKey.name, func.count(ApiKey.id)).where(in_page).group_by(ApiKey.name)
+    )).all())
+    return [(r.name, counts.get(r.name, 0), r.created_at) for r in page]
+
+@router.get("/users")
+async def list_users(q: Optional[str] = None, db: AsyncSession = Depends(get_async_db), _: None = Depends(require_admin)):
+    # group by owner email (ApiKey.name, as in the log views); the filter is applied before
+    # aggregation (WHERE, not HAVING), as lower(name) LIKE to match the trigram index
+    if db.get_bind().dialect.name == "postgresql":
+        rows = await _list_users_pg(db, q)
+    else:
+        query = select(ApiKey.name, func.count(ApiKey.id).label("key_count"), func.min(ApiKey.created_at).label("created_at"))
+        if q:
+            query = query.where(func.lower(ApiKey.name).like(func.lower(f"%{q}%")))
+        query = query.group_by(ApiKey.name)
+        rows = (await db.execute(query.order_by(func.min(ApiKey.created_at).desc()).limit(USERS_PAGE))).all()
     return [{"email": r[0], "key_count": r[1], "created_at": r[2].isoformat() if r[2] else None} for r in rows]
 
+# Unreachable while routes_keys registers GET /admin/keys first (see main.py, "Mount routers")
 @router.get("/keys")
-def list_keys(email: str = Query(...), db: Session = Depends(get_db), _: None = Depends(require_admin)):
-    keys = db.query(ApiKey).filter(ApiKey.email == email).order_by(ApiKey.created_at.desc()).limit(100).all()
+async def list_keys(email: str = Query(...), db: AsyncSession = Depends(get_async_db), _: None = Depends(require_admin)):
+    keys = (await db.execute(
+        select(ApiKey).where(ApiKey.email == email).order_by(ApiKey.created_at.desc()).limit(100)
+    )).scalars().all()
     return [{
         "key": k.key,
         "email": k.email,
@@ -43,79 +74,88 @@ def list_keys(email: str = Query(...), db: Session = Depends(get_db), _: None =
     } for k in keys]
 
 @router.post("/keys")
-def create_key(payload: Dict[str, Any], db: Session = Depends(get_db), _: None = Depends(require_admin)):
+async def create_key(payload: Dict[str, Any], db: AsyncSession = Depends(get_async_db), _: None = Depends(require_admin)):
     email = (payload.get("email") or "").strip()
     if not email:
         raise HTTPException(400, "email required")
     new_key = ApiKey(key=str(uuid.uuid4()), email=email, active=True)
-    db.add(new_key); db.commit(); db.refresh(new_key)
+    db.add(new_key); await db.commit(); await db.refresh(new_key)
     return {"ok": True, "key": new_key.key}
 
+PREVIEW_CHARS = 140
+
+def _parse_ts(s: str) -> Optional[dt.datetime]:
+    """ISO-8601 -> naive datetime (a trailing Z is dropped, as before); None if malformed."""
+    try:
+        return dt.datetime.fromisoformat(s.rstrip("Z"))
+    except ValueError:
+        return None
+
+# Unreachable while routes_keys registers GET /admin/logs first (see main.py, "Mount routers")
 @router.get("/logs")
-def list_logs(
+async def list_logs(
     email: Optional[str] = None,
     q: Optional[str] = None,
     from_: Optional[str] = Query(None, alias="from"),
     to: Optional[str] = None,
     limit: int = 25,
     cursor: Optional[int] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     _: None = Depends(require_admin),
 ):
     limit = max(1, min(limit, 200))
 
-    # Basic cursor = last seen id (descending id order)
-    base = db.query(RequestLog).order_by(RequestLog.id.desc())
+    # Basic cursor = last seen id (descending id order). Explicit columns; the preview is
+    # sliced in SQL rather than after loading the whole row. email is the key owner
+    # (ApiKey.name), path is RequestLog.endpoint, and the logged request/response is
+    # moderation_result, as in the other admin log views.
+    base = (
+        select(
+            RequestLog.id,
+            RequestLog.created_at,
+            ApiKey.name.label("email"),
+            RequestLog.endpoint,
+            RequestLog.status_code,
+            func.substr(cast(RequestLog.moderation_result, Text), 1, PREVIEW_CHARS).label("preview"),
+            RequestLog.duration_ms,
+        )
+        .outerjoin(ApiKey, ApiKey.id == RequestLog.api_key_id)
+        .order_by(RequestLog.id.desc())
+    )
     if cursor:
-        base = base.filter(RequestLog.id < cursor)
+        base = base.where(RequestLog.id < cursor)
 
     if email:
-        base = base.filter(RequestLog.user_email == email)
+        base = base.where(ApiKey.name == email)
 
     if q:
-        like = f"%{q}%"
-        base = base.filter(or_(
-            RequestLog.request_body.ilike(like),
-            RequestLog.response_body.ilike(like),
-            RequestLog.path.ilike(like)
-        ))
-
-    def parse_ts(s):
-        try:
-            return dt.datetime.fromisoformat(s.replace("Z",""))
-        except Exception:
-            return None
-
-    f_dt = parse_ts(from_) if from_ else None
-    t_dt = parse_ts(to) if to else None
+        # lower(CAST(... AS TEXT)) LIKE matches the Postgres trigram index expression
+        base = base.where(func.lower(cast(RequestLog.moderation_result, Text)).like(func.lower(f"%{q}%")))
+
+    f_dt = _parse_ts(from_) if from_ else None
+    t_dt = _parse_ts(to) if to else None
     if f_dt:
-        base = base.filter(RequestLog.created_at >= f_dt)
+        base = base.where(RequestLog.created_at >= f_dt)
     if t_dt:
-        base = base.filter(RequestLog.created_at <= t_dt)
+        base = base.where(RequestLog.created_at <= t_dt)
 
-    items = base.limit(limit + 1).all()
-    next_cursor = items[-1].id if len(items) > limit else None
+    items = (await db.execute(base.limit(limit + 1))).all()
+    next_cursor = items[limit - 1].id if len(items) > limit else None
     items = items[:limit]
 
-    def preview(s: Optional[str], n=140):
-        if not s:
-            return None
-        return s[:n]
-
     out = []
     for r in items:
         out.append({
             "id": r.id,
             "created_at": r.created_at.isoformat() if r.created_at else None,
-            "email": getattr(r, "user_email", None),
-            "path": r.path,
+            "email": r.email,
+            "path": r.endpoint,
             "status_code": r.status_code,
-            "request_preview": preview(r.request_body),
-            "response_preview": preview(r.response_body),
-            "request_body": r.request_body,
-            "response_body": r.response_body,
+            # moderation_result holds both the input and the response; the dashboard
+            # (static/admin.html) reads request_preview || response_preview
+            "request_preview": r.preview or None,
             "duration_ms": r.duration_ms,
-            "method": r.method,
-            "request_id": r.request_id,
         })
+    # The full record is served by GET /admin/logs/{log_id} (routes_keys)
     return {"items": out, "next_cursor": next_cursor}
+
@@ -1,14 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, cast
-from sqlalchemy.types import String
-from typing import Optional, List
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, desc, cast, func
+from sqlalchemy.types import Text
+from typing import Any, Optional, List
+import datetime as dt
+import hashlib
 from config import SIGNUP_SECRET, KEY_PREFIX, KEY_BYTES
-from db import SessionLocal, ApiKey, RequestLog, init_db
-from key_utils import generate_key, hash_key
+from db import get_async_db, ApiKey, RequestLog
+from deps import require_signup_secret, get_api_key_record
+from key_utils import generate_key, key_lookup, invalidate_key
 
-init_db()
 router = APIRouter()
 
 class KeyCreateRequest(BaseModel):
@@ -18,166 +20,230 @@ class KeyCreateResponse(BaseModel):
     key: str
     id: int
 
+MAX_BATCH_KEYS = 100
+
+class KeyBatchCreateRequest(BaseModel):
+    keys: List[KeyCreateRequest] = Field(..., min_length=1, max_length=MAX_BATCH_KEYS)
+
 class KeyInfo(BaseModel):
     id: int
     name: Optional[str]
     prefix: str
     is_active: bool
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def require_signup_secret(x_signup_secret: Optional[str] = Header(default=None, convert_underscores=False)):
-    # In prod, require header to match SIGNUP_SECRET; in dev (unset), allow.
-    if SIGNUP_SECRET:
-        if not x_signup_secret or x_signup_secret != SIGNUP_SECRET:
-            raise HTTPException(status_code=401, detail="Missing or invalid signup secret")
-
-def get_api_key_record(x_api_key: Optional[str] = Header(default=None, convert_underscores=False), db: Session = Depends(get_db)) -> ApiKey:
-    if not x_api_key:
-        raise HTTPException(status_code=401, detail="Missing API key")
-    rows = db.query(ApiKey).filter(ApiKey.is_active == True).all()
-    for rec in rows:
-        if hash_key(rec.key_salt, x_api_key) == rec.key_hash:
-            return rec
-    raise HTTPException(status_code=401, detail="Invalid API key")
+def _new_key_row(name: Optional[str]):
+    """Return (plaintext, insert values) for a fresh key."""
+    plaintext, salt, h = generate_key(KEY_PREFIX, KEY_BYTES)
+    return plaintext, {
+        "name": name,
+        "key_salt": salt,
+        "key_hash": h,
+        "key_lookup": key_lookup(plaintext),
+        "prefix": KEY_PREFIX,
+        "is_active": True,
+    }
 
 @router.post("/keys", response_model=KeyCreateResponse, summary="Create a new API key (self-serve)")
-def create_key(payload: KeyCreateRequest, db: Session = Depends(get_db), _ok=Depends(require_signup_secret)):
-    plaintext, salt, h = generate_key(KEY_PREFIX, KEY_BYTES)
-    rec = ApiKey(name=payload.name, key_salt=salt, key_hash=h, prefix=KEY_PREFIX, is_active=True)
-    db.add(rec)
-    db.commit()
-    db.refresh(rec)
-    return {"key": plaintext, "id": rec.id}
+async def create_key(payload: KeyCreateRequest, db: AsyncSession = Depends(get_async_db), _ok=Depends(require_signup_secret)):
+    plaintext, row = _new_key_row(payload.name)
+    # RETURNING hands back the id, so no refresh() round trip
+    key_id = (await db.execute(insert(ApiKey).values(row).returning(ApiKey.id))).scalar_one()
+    await db.commit()
+    return {"key": plaintext, "id": key_id}
+
+@router.post("/keys/batch", response_model=List[KeyCreateResponse], summary="Create several API keys in one request")
+async def create_keys_batch(payload: KeyBatchCreateRequest, db: AsyncSession = Depends(get_async_db), _ok=Depends(require_signup_secret)):
+    plaintexts, rows = zip(*(_new_key_row(k.name) for k in payload.keys))
+    # One multi-row INSERT ... RETURNING and one commit for the whole batch
+    result = await db.execute(
+        insert(ApiKey).returning(ApiKey.id, sort_by_parameter_order=True),
+        list(rows),
+    )
+    ids = result.scalars().all()
+    await db.commit()
+    return [{"key": k, "id": i} for k, i in zip(plaintexts, ids)]
 
 @router.get("/keys/me", response_model=KeyInfo, summary="Get info about your API key")
-def me(rec: ApiKey = Depends(get_api_key_record)):
+async def me(rec: ApiKey = Depends(get_api_key_record)):
     return {"id": rec.id, "name": rec.name, "prefix": rec.prefix, "is_active": rec.is_active}
 
 @router.delete("/keys/me", summary="Revoke your API key")
-def revoke_self(rec: ApiKey = Depends(get_api_key_record), db: Session = Depends(get_db)):
+async def revoke_self(rec: ApiKey = Depends(get_api_key_record), db: AsyncSession = Depends(get_async_db)):
     rec.is_active = False
     db.add(rec)
-    db.commit()
+    await db.commit()
+    invalidate_key(rec.id)
     return {"ok": True, "message": "Key revoked"}
 
 # Admin utilities
+ADMIN_KEYS_MAX = 500
+
 @router.get("/admin/keys", response_model=List[KeyInfo], summary="List keys (admin)")
-def admin_list(db: Session = Depends(get_db), _ok=Depends(require_signup_secret)):
-    rows = db.query(ApiKey).order_by(ApiKey.id.desc()).all()
-    return [KeyInfo(id=r.id, name=r.name, prefix=r.prefix, is_active=r.is_active) for r in rows]
+async def admin_list(
+    limit: int = ADMIN_KEYS_MAX,
+    cursor: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
+    _ok=Depends(require_signup_secret),
+):
+    # Only the listed columns; key_hash/key_salt never leave the database.
+    # Bounded page, newest first; pass the last id seen as cursor for the next page.
+    stmt = select(ApiKey.id, ApiKey.name, ApiKey.prefix, ApiKey.is_active).order_by(ApiKey.id.desc())
+    if cursor:
+        stmt = stmt.where(ApiKey.id < cursor)
+    rows = (await db.execute(stmt.limit(min(max(limit, 1), ADMIN_KEYS_MAX)))).mappings().all()
+    return rows
 
 @router.delete("/admin/keys/{key_id}", summary="Revoke key by id (admin)")
-def admin_revoke(key_id: int, db: Session = Depends(get_db), _ok=Depends(require_signup_secret)):
-    rec = db.query(ApiKey).get(key_id)
+async def admin_revoke(key_id: int, db: AsyncSession = Depends(get_async_db), _ok=Depends(require_signup_secret)):
+    rec = await db.get(ApiKey, key_id)
     if not rec:
         raise HTTPException(status_code=404, detail="Key not found")
     rec.is_active = False
     db.add(rec)
-    db.commit()
+    await db.commit()
+    invalidate_key(rec.id)
     return {"ok": True, "message": f"Key {key_id} revoked"}
 
 # ===== Debug endpoint (no secret value leak) =====
-import hashlib as _hl
-from fastapi import APIRouter as _AR
-from config import SIGNUP_SECRET as _SS
+debug_router = APIRouter()
 
-debug_router = _AR()
+# The secret never changes at runtime, so the debug payload is computed once
+_SIGNUP_DEBUG = {
+    "signup_secret_present": bool(SIGNUP_SECRET),
+    "signup_secret_len": len(SIGNUP_SECRET or ""),
+    "signup_secret_sha256_prefix": hashlib.sha256(SIGNUP_SECRET.encode()).hexdigest()[:12] if SIGNUP_SECRET else None,
+}
 
 @debug_router.get("/_debug/signups")
 def debug_signups():
-    val = _SS or ""
-    return {
-        "signup_secret_present": bool(val),
-        "signup_secret_len": len(val),
-        "signup_secret_sha256_prefix": _hl.sha256(val.encode()).hexdigest()[:12] if val else None
-    }
+    return _SIGNUP_DEBUG
 
 
-@router.get("/admin/logs", summary="List recent request logs (admin)")
-def admin_logs(
+LOG_PREVIEW_CHARS = 600
+
+class LogSummary(BaseModel):
+    id: int
+    api_key_id: Optional[int]
+    api_key_owner: Optional[str]
+    endpoint: Optional[str]
+    status_code: Optional[int]
+    duration_ms: Optional[int]
+    request_size_bytes: Optional[int]
+    created_at: Optional[dt.datetime]
+    moderation_result_preview: Optional[str]
+
+class LogPage(BaseModel):
+    items: List[LogSummary]
+    limit: int
+    next_cursor: Optional[int]
+
+class LogDetail(BaseModel):
+    id: int
+    api_key_id: Optional[int]
+    api_key_owner: Optional[str]
+    endpoint: Optional[str]
+    status_code: Optional[int]
+    duration_ms: Optional[int]
+    request_size_bytes: Optional[int]
+    created_at: Optional[dt.datetime]
+    moderation_result: Any
+
+# The log endpoints declare response models, so FastAPI writes the rows (datetimes
+# included) straight to JSON bytes through Pydantic, with no jsonable_encoder pass.
+@router.get("/admin/logs", response_model=LogPage, summary="List recent request logs (admin)")
+async def admin_logs(
     limit: int = 50,
-    offset: int = 0,
+    cursor: Optional[int] = None,
     api_key_id: int = None,
     user_email: str = None,
     contains: str = None,
     endpoint: str = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     _ok=Depends(require_signup_secret)
 ):
-    q = db.query(RequestLog).order_by(desc(RequestLog.id))
+    limit = min(max(limit, 1), 500)
+    # Keyset pagination: cursor = last id seen (descending id order), no OFFSET scan.
+    # Owner name comes from the same query via LEFT JOIN. Only the listed columns
+    # and a preview-sized slice of moderation_result leave the database.
+    q = (
+        select(
+            RequestLog.id,
+            RequestLog.api_key_id,
+            ApiKey.name.label("api_key_owner"),
+            RequestLog.endpoint,
+            RequestLog.status_code,
+            RequestLog.duration_ms,
+            RequestLog.request_size_bytes,
+            RequestLog.created_at,
+            # one extra char tells us whether the preview was truncated
+            func.substr(cast(RequestLog.moderation_result, Text), 1, LOG_PREVIEW_CHARS + 1).label("preview"),
+        )
+        .outerjoin(ApiKey, ApiKey.id == RequestLog.api_key_id)
+        .order_by(desc(RequestLog.id))
+    )
+    if cursor:
+        q = q.where(RequestLog.id < cursor)
 
     # Filter by endpoint
     if endpoint:
-        q = q.filter(RequestLog.endpoint == endpoint)
+        q = q.where(RequestLog.endpoint == endpoint)
 
     # Filter by api_key_id
     if api_key_id is not None:
-        q = q.filter(RequestLog.api_key_id == api_key_id)
+        q = q.where(RequestLog.api_key_id == api_key_id)
 
-    # Filter by email via ApiKey.name (owner/email field)
+    # Filter by email via ApiKey.name (owner/email field), on the owner join above:
+    # one query, no id list round trip. lower() LIKE matches the trigram index.
     if user_email:
-        key_ids = [r.id for r in db.query(ApiKey.id).filter(ApiKey.name.ilike(f"%{user_email}%")).all()]
-        if key_ids:
-            q = q.filter(RequestLog.api_key_id.in_(key_ids))
-        else:
-            return {"items": [], "limit": limit, "offset": offset}
+        q = q.where(func.lower(ApiKey.name).like(func.lower(f"%{user_email}%")))
 
-    # Search 'contains' within moderation_result JSON/Text
+    # Search 'contains' within moderation_result JSON/Text. lower(CAST(... AS TEXT)) LIKE
+    # matches the Postgres trigram index expression (see migrate.py).
     if contains:
-        q = q.filter(cast(RequestLog.moderation_result, String).ilike(f"%{contains}%"))
-
-    rows = q.offset(offset).limit(min(max(limit, 1), 500)).all()
+        q = q.where(func.lower(cast(RequestLog.moderation_result, Text)).like(func.lower(f"%{contains}%")))
 
-    # Map api_key_id -> owner (email/name)
-    key_rows = db.query(ApiKey.id, ApiKey.name).all()
-    owner_map = {kid: nm for kid, nm in key_rows}
+    rows = (await db.execute(q.limit(limit + 1))).all()
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    rows = rows[:limit]
 
     out = []
     for r in rows:
-        preview = None
-        try:
-            blob = r.moderation_result
-            preview = blob if isinstance(blob, str) else str(blob)
-            if len(preview) > 600:
-                preview = preview[:600] + "...(truncated)"
-        except Exception:
-            preview = None
+        preview = r.preview
+        if preview is not None and len(preview) > LOG_PREVIEW_CHARS:
+            preview = preview[:LOG_PREVIEW_CHARS] + "...(truncated)"
         out.append({
             "id": r.id,
             "api_key_id": r.api_key_id,
-            "api_key_owner": owner_map.get(r.api_key_id),
+            "api_key_owner": r.api_key_owner,
             "endpoint": r.endpoint,
             "status_code": r.status_code,
             "duration_ms": r.duration_ms,
             "request_size_bytes": r.request_size_bytes,
-            "created_at": r.created_at.isoformat() if hasattr(r.created_at, "isoformat") and r.created_at else None,
+            "created_at": r.created_at,
             "moderation_result_preview": preview
         })
-    return {"items": out, "limit": limit, "offset": offset}
+    return {"items": out, "limit": limit, "next_cursor": next_cursor}
 
 
 
-@router.get("/admin/logs/{log_id}", summary="Get full log record (admin)")
-def admin_log_detail(log_id: int, db: Session = Depends(get_db), _ok=Depends(require_signup_secret)):
-    r = db.query(RequestLog).get(log_id)
-    if not r:
+@router.get("/admin/logs/{log_id}", response_model=LogDetail, summary="Get full log record (admin)")
+async def admin_log_detail(log_id: int, db: AsyncSession = Depends(get_async_db), _ok=Depends(require_signup_secret)):
+    row = (await db.execute(
+        select(RequestLog, ApiKey.name)
+        .outerjoin(ApiKey, ApiKey.id == RequestLog.api_key_id)
+        .where(RequestLog.id == log_id)
+    )).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Log not found")
-    owner = db.query(ApiKey).get(r.api_key_id) if r.api_key_id else None
+    r, owner = row
     return {
         "id": r.id,
         "api_key_id": r.api_key_id,
-        "api_key_owner": getattr(owner, "name", None),
+        "api_key_owner": owner,
         "endpoint": r.endpoint,
         "status_code": r.status_code,
         "duration_ms": r.duration_ms,
         "request_size_bytes": r.request_size_bytes,
-        "created_at": r.created_at.isoformat() if hasattr(r.created_at, "isoformat") and r.created_at else None,
+        "created_at": r.created_at,
         "moderation_result": r.moderation_result,
     }
-